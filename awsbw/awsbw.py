@@ -1,14 +1,722 @@
 #!/usr/bin/env python3
-import boto3
 import curses
 from curses import wrapper
 from curses import panel
 import sys
 import argparse
+import json
+import os
+import re
+import threading
 import time
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
 from multiprocessing import Process, Manager
-from collections import Counter
+from collections import Counter, OrderedDict, deque
+
+# Where AWS batch sends job logs unless the job definition says otherwise
+LOG_GROUP = '/aws/batch/job'
+
+
+def awsSession(profile):
+    # boto3 takes most of a second to import, so it is only loaded once we
+    # actually need to talk to AWS (never for --help or the first frame).
+    import boto3
+    import botocore.exceptions
+    try:
+        return boto3.session.Session(profile_name=profile)
+    except botocore.exceptions.ProfileNotFound:
+        raise ValueError(
+            "AWS profile {} does not exist. Available profiles: {}".format(
+                profile,
+                ", ".join(boto3.session.Session().available_profiles)
+            )
+        )
+
+
+def listJobs(batch_client, queue, status='RUNNING'):
+    jobs_QS = batch_client.list_jobs(
+        jobQueue=queue,
+        jobStatus=status,
+    )
+    JSL = jobs_QS.get('jobSummaryList', [])
+    nextToken = jobs_QS.get('nextToken', None)
+    while nextToken is not None:
+        jobs_QS = batch_client.list_jobs(
+            jobQueue=queue,
+            jobStatus=status,
+            nextToken=nextToken,
+        )
+        JSL += jobs_QS.get('jobSummaryList', [])
+        nextToken = jobs_QS.get('nextToken', None)
+
+    for j in JSL:
+        j.update({'queue': queue})
+    return JSL
+
+
+def describeJobs(batch_client, jobIds):
+    # describe_jobs takes at most 100 jobs per call
+    jobs = []
+    for i in range(0, len(jobIds), 100):
+        jobs += batch_client.describe_jobs(
+            jobs=jobIds[i:i + 100]
+        ).get('jobs', [])
+    return jobs
+
+
+def jobLogStream(jobDetails):
+    """(logGroupName, logStreamName) for a describe_jobs entry, or None if it never logged."""
+    container = jobDetails.get('container', {})
+    stream = container.get('logStreamName')
+    if stream is None:
+        # Retried jobs keep earlier streams on their attempts
+        for attempt in reversed(jobDetails.get('attempts', [])):
+            stream = attempt.get('container', {}).get('logStreamName')
+            if stream is not None:
+                break
+    if stream is None:
+        return None
+    group = container.get('logConfiguration', {}).get('options', {}).get('awslogs-group', LOG_GROUP)
+    return (group, stream)
+
+
+class RateLimiter():
+    """Spaces out calls shared between threads to at most rate per second."""
+    def __init__(self, rate):
+        self.__interval__ = 1.0 / max(float(rate), 0.001)
+        self.__nextCall__ = time.time()
+        self.__lock__ = threading.Lock()
+
+    def wait(self, cancel=None):
+        with self.__lock__:
+            now = time.time()
+            delay = self.__nextCall__ - now
+            self.__nextCall__ = max(now, self.__nextCall__) + self.__interval__
+        if delay > 0:
+            if cancel is None:
+                time.sleep(delay)
+            else:
+                cancel.wait(delay)
+
+
+class LogExporter():
+    """
+    Downloads complete log streams for many jobs to gzip files, several
+    streams at a time. Pages are written as they arrive, so no log is ever
+    held in memory whole.
+    """
+    def __init__(self, batch_client, logs_client, directory, workers=8, rate=10):
+        self.__batch_client__ = batch_client
+        self.__logs_client__ = logs_client
+        self.__directory__ = directory
+        self.__workers__ = max(int(workers), 1)
+        self.__limiter__ = RateLimiter(rate)
+
+    def logPath(self, job):
+        return os.path.join(
+            self.__directory__,
+            "{}_{}.log.gz".format(
+                re.sub(r'[^\w.-]', '_', job.get('jobName', 'job')),
+                job['jobId']
+            )
+        )
+
+    def exportStream(self, job, logStream, cancel):
+        import gzip
+        path = self.logPath(job)
+        partial = path + '.partial'
+        kwargs = {
+            'logGroupName': logStream[0],
+            'logStreamName': logStream[1],
+            'startFromHead': True,
+        }
+        try:
+            with gzip.open(partial, 'wt', encoding='utf-8') as out:
+                while True:
+                    self.__limiter__.wait(cancel)
+                    if cancel is not None and cancel.is_set():
+                        raise Exception("cancelled")
+                    page = self.__logs_client__.get_log_events(**kwargs)
+                    for e in page.get('events', []):
+                        out.write(e['message'] + '\n')
+                    # The end of the stream hands back the token we sent
+                    nextToken = page.get('nextForwardToken')
+                    if nextToken is None or nextToken == kwargs.get('nextToken'):
+                        break
+                    kwargs['nextToken'] = nextToken
+            os.replace(partial, path)
+        except:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        return path
+
+    def exportJobs(self, jobs, cancel=None, onDone=None):
+        """
+        Export logs for job dicts (jobId and jobName). onDone(job, path, error)
+        is called from worker threads as each job finishes.
+        Returns [(job, path, error), ...].
+        """
+        os.makedirs(self.__directory__, exist_ok=True)
+        results = []
+
+        def finish(job, path, error):
+            results.append((job, path, error))
+            if onDone is not None:
+                onDone(job, path, error)
+
+        def export(job, logStream):
+            try:
+                finish(job, self.exportStream(job, logStream, cancel), None)
+            except Exception as e:
+                finish(job, None, str(e))
+
+        try:
+            details = {
+                d['jobId']: d for d in
+                describeJobs(self.__batch_client__, [j['jobId'] for j in jobs])
+            }
+        except Exception as e:
+            for job in jobs:
+                finish(job, None, str(e))
+            return results
+        # Like boto3, only loaded when exporting (keeps it off the --help path)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.__workers__) as pool:
+            for job in jobs:
+                logStream = jobLogStream(details.get(job['jobId'], {}))
+                if logStream is None:
+                    finish(job, None, "no log stream")
+                else:
+                    pool.submit(export, job, logStream)
+        return results
+
+
+class LogGrep():
+    """
+    Searches the log streams of many jobs for a CloudWatch Logs filter
+    pattern with filter_log_events, one request per 100 streams and several
+    requests at a time.
+    """
+    def __init__(self, batch_client, logs_client, workers=8, rate=10):
+        self.__batch_client__ = batch_client
+        self.__logs_client__ = logs_client
+        self.__workers__ = max(int(workers), 1)
+        self.__limiter__ = RateLimiter(rate)
+
+    def searchStreams(self, logGroupName, streamJobs, pattern, cancel, onHit):
+        kwargs = {
+            'logGroupName': logGroupName,
+            'logStreamNames': list(streamJobs),
+            'filterPattern': pattern,
+            # Nothing logged before the jobs existed, so skip scanning it
+            'startTime': int(min(j['createdAt'] for j in streamJobs.values())),
+        }
+        while True:
+            self.__limiter__.wait(cancel)
+            if cancel is not None and cancel.is_set():
+                return
+            page = self.__logs_client__.filter_log_events(**kwargs)
+            for e in page.get('events', []):
+                onHit(streamJobs[e['logStreamName']], e)
+            if page.get('nextToken') is None:
+                return
+            kwargs['nextToken'] = page['nextToken']
+
+    def grep(self, jobs, pattern, cancel=None, onHit=None, onProgress=None):
+        """
+        Search the logs of job dicts for pattern. From worker threads,
+        onHit(job, event) is called for each matching event and
+        onProgress(done, total, error) as each batch of streams finishes.
+        """
+        onHit = onHit if onHit is not None else (lambda job, e: None)
+        onProgress = onProgress if onProgress is not None else (lambda done, total, error: None)
+        try:
+            details = {
+                d['jobId']: d for d in
+                describeJobs(self.__batch_client__, [j['jobId'] for j in jobs])
+            }
+        except Exception as e:
+            onProgress(0, 0, str(e))
+            return
+        groupStreams = {}
+        for job in jobs:
+            logStream = jobLogStream(details.get(job['jobId'], {}))
+            if logStream is not None:
+                groupStreams.setdefault(logStream[0], {})[logStream[1]] = job
+        batches = []
+        for (logGroupName, streamJobs) in groupStreams.items():
+            streams = list(streamJobs)
+            # filter_log_events takes at most 100 stream names
+            for i in range(0, len(streams), 100):
+                batches.append((logGroupName, {s: streamJobs[s] for s in streams[i:i + 100]}))
+        progress = {'done': 0}
+        lock = threading.Lock()
+        onProgress(0, len(batches), None)
+
+        def search(logGroupName, streamJobs):
+            error = None
+            try:
+                self.searchStreams(logGroupName, streamJobs, pattern, cancel, onHit)
+            except Exception as e:
+                error = str(e)
+            with lock:
+                progress['done'] += 1
+                onProgress(progress['done'], len(batches), error)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.__workers__) as pool:
+            for (logGroupName, streamJobs) in batches:
+                pool.submit(search, logGroupName, streamJobs)
+
+
+def snapshotDelta(prior, current):
+    """
+    Between two {jobId: job} snapshots, the jobs that are new or changed and
+    the jobIds that are gone.
+    """
+    upserts = [j for jobId, j in current.items() if prior.get(jobId) != j]
+    removals = [jobId for jobId in prior if jobId not in current]
+    return (upserts, removals)
+
+
+def statusTransitions(prior, upserts, t, queues=None):
+    """
+    The status changes in upserts against the {jobId: job} snapshot prior, as
+    transition dicts. Jobs new to prior count only if their queue is in queues
+    (when given), so the jobs of a queue that was just added are not reported.
+    """
+    transitions = []
+    for job in upserts:
+        before = prior.get(job['jobId'])
+        if before is not None and before['status'] == job['status']:
+            continue
+        if before is None and queues is not None and job['queue'] not in queues:
+            continue
+        transitions.append({
+            'time': t,
+            'jobId': job['jobId'],
+            'jobName': job['jobName'],
+            'queue': job['queue'],
+            'fromStatus': before['status'] if before is not None else None,
+            'status': job['status'],
+        })
+    return transitions
+
+
+class SnapshotRecorder():
+    """
+    Appends polling snapshots to a JSON lines file. Most lines hold only what
+    changed since the previous snapshot (new jobs, changed fields, removed
+    jobIds); every keyframeEvery snapshots a line holds every job, so a replay
+    can start from any keyframe. A sidecar .idx file lists each line's time,
+    byte offset and whether it is a keyframe.
+    """
+    def __init__(self, path, keyframeEvery=60):
+        self.__file__ = open(path, 'ab')
+        self.__index__ = open(path + '.idx', 'a')
+        self.__keyframeEvery__ = keyframeEvery
+        self.__sinceKeyframe__ = None
+        self.__prior__ = {}
+
+    def record(self, t, jobs, queues):
+        current = {j['jobId']: j for j in jobs}
+        # Each session starts with a keyframe, so appending to a file is safe
+        if self.__sinceKeyframe__ is None or self.__sinceKeyframe__ >= self.__keyframeEvery__:
+            entry = {'k': 1, 't': t, 'queues': list(queues), 'jobs': jobs}
+            self.__sinceKeyframe__ = 0
+        else:
+            (upserts, removals) = snapshotDelta(self.__prior__, current)
+            if len(upserts) == 0 and len(removals) == 0:
+                return
+            entry = {'t': t}
+            new = [j for j in upserts if j['jobId'] not in self.__prior__]
+            changed = []
+            for j in upserts:
+                prior = self.__prior__.get(j['jobId'])
+                if prior is not None:
+                    # Only the fields that differ; null marks one that went away
+                    fields = {k: v for k, v in j.items() if prior.get(k) != v}
+                    fields.update({k: None for k in prior if k not in j})
+                    fields['jobId'] = j['jobId']
+                    changed.append(fields)
+            if len(new) > 0:
+                entry['new'] = new
+            if len(changed) > 0:
+                entry['chg'] = changed
+            if len(removals) > 0:
+                entry['del'] = removals
+            self.__sinceKeyframe__ += 1
+        self.__prior__ = current
+        offset = self.__file__.tell()
+        self.__file__.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+        self.__file__.flush()
+        self.__index__.write("{} {} {}\n".format(t, offset, entry.get('k', 0)))
+        self.__index__.flush()
+
+
+class SnapshotReplay():
+    """
+    Reads a SnapshotRecorder file back. seek() jumps to the nearest keyframe
+    at or before a time and applies deltas from there; advance() moves forward.
+    """
+    def __init__(self, path):
+        self.__path__ = path
+        self.__file__ = open(path, 'rb')
+        self.__index__ = self.loadIndex()
+        if len(self.__index__) == 0 or not self.__index__[0][2]:
+            raise ValueError("No snapshots recorded in {}".format(path))
+        self.__times__ = [i[0] for i in self.__index__]
+        self.__keyframes__ = [i for i, entry in enumerate(self.__index__) if entry[2]]
+        self.__position__ = 0
+        self.__jobs__ = {}
+        self.__queues__ = []
+        self.__time__ = None
+        self.seek(self.start())
+
+    def loadIndex(self):
+        size = os.path.getsize(self.__path__)
+        try:
+            with open(self.__path__ + '.idx') as idx:
+                index = []
+                for line in idx:
+                    (t, offset, keyframe) = line.split()
+                    index.append((float(t), int(offset), keyframe == '1'))
+            # Anything past the end of the recording was never fully written
+            index = [entry for entry in index if entry[1] < size]
+            if self.indexCovers(index, size):
+                return index
+        except (OSError, ValueError):
+            pass
+        # No usable index: rebuild it with one pass over the recording
+        index = []
+        offset = 0
+        self.__file__.seek(0)
+        for line in self.__file__:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            index.append((entry['t'], offset, entry.get('k', 0) == 1))
+            offset += len(line)
+        return index
+
+    def indexCovers(self, index, size):
+        # A sidecar that was lost and restarted by a later session only covers
+        # that session, and one that fell behind misses the last lines: it must
+        # start at the first line and its last entry must be the last line.
+        if len(index) == 0 or index[0][1] != 0:
+            return False
+        self.__file__.seek(index[-1][1])
+        line = self.__file__.readline()
+        try:
+            last = json.loads(line)
+        except ValueError:
+            return False
+        return last.get('t') == index[-1][0] and index[-1][1] + len(line) == size
+
+    def start(self):
+        return self.__times__[0]
+
+    def end(self):
+        return self.__times__[-1]
+
+    def time(self):
+        return self.__time__
+
+    def queues(self):
+        return list(self.__queues__)
+
+    def jobs(self):
+        return list(self.__jobs__.values())
+
+    def applyEntry(self, entry):
+        if entry.get('k', 0) == 1:
+            self.__jobs__ = {j['jobId']: j for j in entry['jobs']}
+            self.__queues__ = entry['queues']
+        else:
+            for j in entry.get('new', []):
+                self.__jobs__[j['jobId']] = j
+            for fields in entry.get('chg', []):
+                job = dict(self.__jobs__.get(fields['jobId'], {}))
+                job.update(fields)
+                self.__jobs__[fields['jobId']] = {k: v for k, v in job.items() if v is not None}
+            for jobId in entry.get('del', []):
+                self.__jobs__.pop(jobId, None)
+        self.__time__ = entry['t']
+
+    def advance(self, t):
+        """Apply everything recorded up to t. Returns True if anything was applied."""
+        applied = False
+        while self.__position__ < len(self.__index__) and self.__times__[self.__position__] <= t:
+            self.__file__.seek(self.__index__[self.__position__][1])
+            try:
+                entry = json.loads(self.__file__.readline())
+            except ValueError:
+                # A half-written last line: treat it as the end
+                self.__position__ = len(self.__index__)
+                break
+            self.applyEntry(entry)
+            self.__position__ += 1
+            applied = True
+        return applied
+
+    def seek(self, t):
+        last = max(bisect_right(self.__times__, t) - 1, 0)
+        self.__position__ = self.__keyframes__[bisect_right(self.__keyframes__, last) - 1]
+        self.advance(max(t, self.start()))
+
+
+def firstKeyframe(path):
+    # Every recording session starts with a keyframe, so the first line is
+    # enough to check a file and read its queues without indexing it all
+    with open(path, 'rb') as recording:
+        line = recording.readline()
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        entry = None
+    if not isinstance(entry, dict) or entry.get('k', 0) != 1:
+        raise ValueError("No snapshots recorded in {}".format(path))
+    return entry
+
+
+def describeJobQueues(batch_client):
+    queues = []
+    for page in batch_client.get_paginator('describe_job_queues').paginate():
+        queues += page.get('jobQueues', [])
+    return queues
+
+
+def describeComputeEnvironments(batch_client, computeEnvironments):
+    # describe_compute_environments takes at most 100 environments per call
+    computeEnvironments = sorted(set(computeEnvironments))
+    envs = []
+    for i in range(0, len(computeEnvironments), 100):
+        envs_QS = batch_client.describe_compute_environments(
+            computeEnvironments=computeEnvironments[i:i + 100]
+        )
+        envs += envs_QS.get('computeEnvironments', [])
+        nextToken = envs_QS.get('nextToken', None)
+        while nextToken is not None:
+            envs_QS = batch_client.describe_compute_environments(
+                computeEnvironments=computeEnvironments[i:i + 100],
+                nextToken=nextToken,
+            )
+            envs += envs_QS.get('computeEnvironments', [])
+            nextToken = envs_QS.get('nextToken', None)
+    return envs
+
+
+class JobStore():
+    """
+    Jobs by jobId, updated from polling snapshots, with a name index so the
+    type-to-filter mode never has to scan every job.
+    Names are indexed lower-cased, both as a sorted array (prefix search) and
+    by trigram (substring search).
+    Ordered views for the grid are built on first use for each queue, grouping
+    and ordering, then kept sorted as deltas arrive.
+    """
+    FILTER_MODES = ['substring', 'prefix', 'regex']
+    ORDERINGS = ['created', 'name', 'started', 'runtime']
+    GROUPINGS = ['status', 'definition', 'prefix']
+
+    def __init__(self):
+        self.__jobs__ = {}
+        self.__names__ = []
+        self.__nameJobs__ = {}
+        self.__grams__ = {}
+        self.__version__ = 0
+        self.__lastMatch__ = None
+        self.__views__ = {}
+
+    def __len__(self):
+        return len(self.__jobs__)
+
+    def __contains__(self, jobId):
+        return jobId in self.__jobs__
+
+    def get(self, jobId):
+        return self.__jobs__.get(jobId)
+
+    def jobs(self):
+        return self.__jobs__.values()
+
+    def update(self, jobs):
+        """Replace the contents with a snapshot. Returns the jobIds that changed."""
+        (upserts, removals) = snapshotDelta(self.__jobs__, {j['jobId']: j for j in jobs})
+        self.apply(upserts, removals)
+        return {j['jobId'] for j in upserts} | set(removals)
+
+    def apply(self, upserts, removals):
+        changes = []
+        oldNames = []
+        for jobId in removals:
+            prior = self.__jobs__.pop(jobId, None)
+            if prior is not None:
+                changes.append((prior, None))
+            oldNames += self.unindexJob(prior)
+        newNames = []
+        for job in upserts:
+            prior = self.__jobs__.get(job['jobId'])
+            self.__jobs__[job['jobId']] = job
+            changes.append((prior, job))
+            if prior is None or prior['jobName'] != job['jobName']:
+                oldNames += self.unindexJob(prior)
+                newNames += self.indexJob(job)
+        self.updateViews(changes)
+        # One at a time is quadratic for a big snapshot, so batch large changes
+        if len(oldNames) > 64:
+            oldNames = set(oldNames)
+            self.__names__ = [n for n in self.__names__ if n not in oldNames]
+        else:
+            for name in oldNames:
+                del self.__names__[bisect_left(self.__names__, name)]
+        if len(newNames) > 64:
+            self.__names__ += newNames
+            self.__names__.sort()
+        else:
+            for name in newNames:
+                insort(self.__names__, name)
+        if len(upserts) > 0 or len(removals) > 0:
+            self.__version__ += 1
+
+    def indexJob(self, job):
+        # Returns the name if it is new to the sorted array
+        name = job['jobName'].lower()
+        if name in self.__nameJobs__:
+            self.__nameJobs__[name].add(job['jobId'])
+            return []
+        self.__nameJobs__[name] = {job['jobId']}
+        for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+            self.__grams__.setdefault(gram, set()).add(name)
+        return [name]
+
+    def unindexJob(self, job):
+        # Returns the name if no other job uses it, for removal from the sorted array
+        if job is None:
+            return []
+        name = job['jobName'].lower()
+        self.__nameJobs__[name].discard(job['jobId'])
+        if len(self.__nameJobs__[name]) > 0:
+            return []
+        del self.__nameJobs__[name]
+        for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+            self.__grams__[gram].discard(name)
+            if len(self.__grams__[gram]) == 0:
+                del self.__grams__[gram]
+        return [name]
+
+    def sortKey(self, job, ordering):
+        if ordering == 'name':
+            return job['jobName'].lower()
+        elif ordering == 'started':
+            # Most recently started first, then jobs yet to start
+            if job.get('startedAt') is None:
+                return (1, 0)
+            return (0, -job['startedAt'])
+        elif ordering == 'runtime':
+            # Running jobs first (longest running first), then finished jobs
+            # by runtime, then jobs yet to start. Independent of the clock, so
+            # the order only changes when a job does.
+            if job.get('startedAt') is None:
+                return (2, 0)
+            elif job.get('stoppedAt') is None:
+                return (0, job['startedAt'])
+            return (1, job['startedAt'] - job['stoppedAt'])
+        # created: newest first
+        return -job['createdAt']
+
+    def groupKey(self, job, grouping):
+        if grouping == 'definition':
+            # arn:aws:batch:...:job-definition/name:revision -> name
+            return job.get('jobDefinition', '').split('/')[-1].split(':')[0]
+        elif grouping == 'prefix':
+            return re.split(r'[-_.]', job['jobName'], maxsplit=1)[0]
+        return job['status']
+
+    def view(self, queue, grouping='status', ordering='created'):
+        """For a queue, {group: [(sortKey, jobId), ...]} with each list in order."""
+        viewKey = (queue, grouping, ordering)
+        if viewKey not in self.__views__:
+            groups = {}
+            for job in self.__jobs__.values():
+                if job['queue'] == queue:
+                    groups.setdefault(self.groupKey(job, grouping), []).append(
+                        (self.sortKey(job, ordering), job['jobId'])
+                    )
+            for entries in groups.values():
+                entries.sort()
+            self.__views__[viewKey] = groups
+        return self.__views__[viewKey]
+
+    def updateViews(self, changes):
+        for (queue, grouping, ordering), groups in self.__views__.items():
+            gone = {}
+            new = {}
+            for (prior, job) in changes:
+                if prior is not None and prior['queue'] == queue:
+                    gone.setdefault(self.groupKey(prior, grouping), set()).add(
+                        (self.sortKey(prior, ordering), prior['jobId'])
+                    )
+                if job is not None and job['queue'] == queue:
+                    new.setdefault(self.groupKey(job, grouping), []).append(
+                        (self.sortKey(job, ordering), job['jobId'])
+                    )
+            for group in set(gone) | set(new):
+                entries = groups.setdefault(group, [])
+                # Same batching as the name array: merge big deltas in one pass
+                if len(gone.get(group, ())) + len(new.get(group, ())) > 64:
+                    entries[:] = [e for e in entries if e not in gone.get(group, ())]
+                    entries += new.get(group, [])
+                    entries.sort()
+                else:
+                    for e in gone.get(group, ()):
+                        del entries[bisect_left(entries, e)]
+                    for e in new.get(group, []):
+                        insort(entries, e)
+                if len(entries) == 0:
+                    del groups[group]
+
+    def matchNames(self, query, mode):
+        if mode == 'regex':
+            pattern = re.compile(query, re.IGNORECASE)
+            return [n for n in self.__names__ if pattern.search(n)]
+        query = query.lower()
+        # Typing extends the query, so narrow the previous answer when we can
+        if self.__lastMatch__ is not None:
+            (lastVersion, lastMode, lastQuery, lastNames) = self.__lastMatch__
+            if lastVersion == self.__version__ and lastMode == mode and query.startswith(lastQuery):
+                if mode == 'prefix':
+                    return [n for n in lastNames if n.startswith(query)]
+                return [n for n in lastNames if query in n]
+        if mode == 'prefix':
+            names = []
+            for n in self.__names__[bisect_left(self.__names__, query):]:
+                if not n.startswith(query):
+                    break
+                names.append(n)
+            return names
+        if len(query) < 3:
+            return [n for n in self.__names__ if query in n]
+        postings = sorted(
+            (self.__grams__.get(query[i:i + 3], set()) for i in range(len(query) - 2)),
+            key=len
+        )
+        return [n for n in postings[0].intersection(*postings[1:]) if query in n]
+
+    def match(self, query, mode='substring'):
+        """
+        jobIds whose name matches query, or None when there is no query.
+        Raises re.error for a bad regex.
+        """
+        if len(query) == 0:
+            return None
+        names = self.matchNames(query, mode)
+        if mode != 'regex':
+            self.__lastMatch__ = (self.__version__, mode, query.lower(), names)
+        return {jobId for n in names for jobId in self.__nameJobs__[n]}
 
 
 class AWSBW():
@@ -18,8 +726,27 @@ class AWSBW():
             jobQueues,
             max_age_days=7,
             aws_profile='default',
-            job_polling_sec=60):
-        self.__currentJobs__ = []
+            job_polling_sec=60,
+            capacity_polling_sec=300,
+            export_dir='awsbw-logs',
+            export_workers=8,
+            export_rate=10,
+            record_path=None,
+            replay_path=None,
+            replay_speed=60,
+            bell_statuses=('FAILED',),
+            status_commands=None,
+            status_sockets=None):
+        self.__jobStore__ = JobStore()
+        # Grid layout
+        self.__ordering__ = JobStore.ORDERINGS[0]
+        self.__grouping__ = JobStore.GROUPINGS[0]
+        # Type-to-filter on job names
+        self.__filterQuery__ = ""
+        self.__filterMode__ = JobStore.FILTER_MODES[0]
+        self.__filterTyping__ = False
+        self.__filterMatch__ = None
+        self.__filterError__ = None
         try:
             self.__max_age_days__ = int(max_age_days)
         except:
@@ -28,14 +755,48 @@ class AWSBW():
             self.__job_polling_sec__ = int(job_polling_sec)
         except:
             self.__job_polling_sec__ = 30
+        try:
+            self.__capacity_polling_sec__ = int(capacity_polling_sec)
+        except:
+            self.__capacity_polling_sec__ = 300
         self.__aws_profile__ = aws_profile
+        self.__export_dir__ = export_dir
+        self.__export_workers__ = export_workers
+        self.__export_rate__ = export_rate
+        # Recording and replay of snapshots
+        self.__record_path__ = record_path
+        self.__replay_path__ = replay_path
+        self.__replay_speed__ = replay_speed
+        # Status transitions: the feed, what rings the bell, and hooks by status
+        self.__transitions__ = deque(maxlen=1000)
+        self.__highlighted__ = set()
+        self.__bell_statuses__ = {s.upper() for s in bell_statuses}
+        self.__status_commands__ = status_commands if status_commands is not None else {}
+        self.__status_sockets__ = status_sockets if status_sockets is not None else {}
+        self.__hookPool__ = None
+        self.__jobsDirty__ = False
+        # Sessions and clients, created lazily and per process
+        self.__awsClients__ = {}
+        self.__awsClientLock__ = threading.Lock()
+        # Details and first log page fetched ahead for jobs near the cursor
+        self.__prefetchPool__ = None
+        self.__prefetches__ = {}
+        self.__detailCache__ = OrderedDict()
+        self.__logHeadCache__ = OrderedDict()
+        # A running job's summary does not change as it logs, so its first
+        # page is refetched once it is this many seconds old
+        self.__logHeadMaxAge__ = 10
+        self.__cacheLock__ = threading.Lock()
+        self.__cursorRest__ = (None, 0, False)
+        self.__neighbours__ = []
         # screen stuff
         try:
             curses.curs_set(0)
         except:
             pass
         self.__stdscr__ = stdscr
-        self.__stdscr__.nodelay(True)
+        # Wait briefly for keys rather than spinning
+        self.__stdscr__.timeout(100)
         (curH, curW) = stdscr.getmaxyx()
         self.__stdscr__.clear()
 
@@ -100,7 +861,16 @@ class AWSBW():
                 )
                 x += len(q) + 1
 
-        if x + 20 < curW and self.__lastJobCheck__ is not None:
+        if self.__replay_path__ is not None and self.__lastJobCheck__ is not None:
+            replayStr = "{} x{:g} {}".format(
+                "PAUSED" if self.__jobProcessStatus__.get('replay_paused') else "REPLAY",
+                self.__jobProcessStatus__.get('replay_speed'),
+                datetime.fromtimestamp(
+                    self.__jobProcessStatus__.get('replay_time')).strftime('%Y-%m-%d %H:%M:%S')
+            ).rjust(35)
+            if x + len(replayStr) < curW:
+                self.__stdscr__.addstr(0, curW - len(replayStr) - 1, replayStr)
+        elif x + 20 < curW and self.__lastJobCheck__ is not None:
             # If we have space, add the timestamp of the last check
             self.__stdscr__.addstr(
                 0, curW - 20,
@@ -109,32 +879,100 @@ class AWSBW():
             )
 
         # Footer
-        if curW > 71:
+        if self.__filterTyping__ or len(self.__filterQuery__) > 0:
+            footer = " Filter ({}): {}{} ".format(
+                self.__filterMode__,
+                self.__filterQuery__,
+                "_" if self.__filterTyping__ else "",
+            )
+            if self.__filterError__ is not None:
+                footer += "[{}] ".format(self.__filterError__)
+            if self.__filterTyping__:
+                footer += "TAB mode. ENTER done. ESC clear. "
+            else:
+                footer += "/ edit. ESC clear. "
+        else:
+            # As many hints as fit
+            footer = " "
+            replayHints = [
+                "[ ] hour.",
+                "{ } day.",
+                "- + speed.",
+                "P pause.",
+            ] if self.__replay_path__ is not None else []
+            for hint in replayHints + [
+                    "< > queues.",
+                    "D details.",
+                    "L logs.",
+                    "T terminate.",
+                    "Q quit.",
+                    "/ filter.",
+                    "E export logs.",
+                    "F grep logs.",
+                    "H transitions.",
+                    "O sort: {}.".format(self.__ordering__),
+                    "G group: {}.".format(self.__grouping__),
+                    "S select.",
+                    "C capacity."]:
+                if len(footer) + len(hint) + 3 >= curW:
+                    break
+                footer += hint + " "
+        self.__stdscr__.hline(curH - 1, 1, curses.ACS_HLINE, curW - 2)
+        if curW > len(footer) + 2:
             self.__stdscr__.addstr(
                 curH - 1,
                 max(
                     1,
-                    int(curW / 2) - 34
+                    int(curW / 2) - int(len(footer) / 2)
                 ),
-                " < > queues. D details. L logs. T terminate. Q quit. "
+                footer
             )
         self.__stdscr__.refresh()
 
+    def cutoffTs(self):
+        # In a replay, age is relative to the snapshot on screen
+        if self.__replay_path__ is not None and self.__lastJobCheck__ is not None:
+            now = self.__lastJobCheck__
+        else:
+            now = time.time()
+        return (now - self.__max_age_days__ * 24 * 3600) * 1000
+
     def showJobs(self, moveKey=None):
         win = self.__jobsWin__
+        (winH, winW) = win.getmaxyx()
+        maxJobs = winH - 2
 
-        # Limit to the current queue and recency:
-        cutoff_ts = (time.time() - self.__max_age_days__ * 24 * 3600) * 1000
-
-        jobs = [
-            j for j in
-            self.__currentJobs__
-            if j['queue'] == self.__curJobQueue__ and j['createdAt'] >= cutoff_ts
-        ]
+        # Limit to the current queue, recency and any name filter:
+        cutoff_ts = self.cutoffTs()
 
-        (winH, winW) = win.getmaxyx()
+        groups = self.__jobStore__.view(
+            self.__curJobQueue__,
+            self.__grouping__,
+            self.__ordering__
+        )
+        if self.__grouping__ == 'status':
+            groupNames = [s for s in self.__jobStatuses__ if s in groups]
+        else:
+            groupNames = sorted(groups)
+        # Walk each group in order, stopping once a column is full
+        statuses = []
+        columns = []
+        for group in groupNames:
+            column = []
+            for (key, jobId) in groups[group]:
+                if self.__filterMatch__ is not None and jobId not in self.__filterMatch__:
+                    continue
+                job = self.__jobStore__.get(jobId)
+                if job['createdAt'] < cutoff_ts:
+                    continue
+                column.append(job)
+                if len(column) > maxJobs:
+                    break
+            if len(column) > 0:
+                statuses.append(group)
+                columns.append(column)
 
-        if len(jobs) == 0:
+        if len(columns) == 0:
             if self.__lastJobCheck__ is None:
                 win.erase()
                 win.addnstr(
@@ -150,37 +988,25 @@ class AWSBW():
                 win.addnstr(
                     1,
                     0,
-                    "No Jobs",
+                    "No Jobs" if self.__filterMatch__ is None else "No Jobs match the filter",
                     winW
                 )
                 win.refresh()
                 return
 
-        statuses = [s for s in self.__jobStatuses__ if s in {j['status'] for j in jobs}]
-
         col_width = max([
             max(len(s) + 1 for s in statuses),
-            max(len(j['jobName']) + 1 for j in jobs),
+            max(len(j['jobName']) + 1 for col in columns for j in col),
         ])
 
-        maxJobs = winH - 2
         maxCols = int((winW - 2) / col_width)
 
-        if self.__curJobId__ not in [j['jobId'] for j in jobs if j['status'] in statuses[0:maxCols]]:
-            selected_status_i = 0
-            selected_job_i = 0
-        else:
-            # Job ID is in our list, search for it
-            curJob = [j for j in jobs if j['jobId'] == self.__curJobId__][0]
-            selected_status_i = statuses.index(curJob['status'])
-            selected_job_i = [j['jobId'] for j in jobs if j['status'] == curJob['status']].index(curJob['jobId'])
-            # Do a bit of screen geometry sanity here
-            if selected_status_i > maxCols:
-                selected_status_i = 0
-                selected_job_i = 0
-            if selected_job_i > maxJobs:
-                selected_status_i = 0
-                selected_job_i = 0
+        visible = {
+            j['jobId']: (status_i, job_i)
+            for status_i, col in enumerate(columns[0:maxCols])
+            for job_i, j in enumerate(col)
+        }
+        (selected_status_i, selected_job_i) = visible.get(self.__curJobId__, (0, 0))
 
         if moveKey is not None:
             if moveKey == curses.KEY_UP:
@@ -192,7 +1018,7 @@ class AWSBW():
                 selected_job_i = min([
                     selected_job_i + 1,
                     maxJobs,
-                    len([j for j in jobs if j['status'] == statuses[selected_status_i]]) - 1
+                    len(columns[selected_status_i]) - 1
                 ])
             elif moveKey == curses.KEY_RIGHT:
                 selected_status_i = min(
@@ -202,7 +1028,7 @@ class AWSBW():
                 )
                 selected_job_i = min([
                     selected_job_i,
-                    len([j for j in jobs if j['status'] == statuses[selected_status_i]]) - 1
+                    len(columns[selected_status_i]) - 1
                 ])
             elif moveKey == curses.KEY_LEFT:
                 selected_status_i = max(
@@ -211,7 +1037,7 @@ class AWSBW():
                 )
                 selected_job_i = min([
                     selected_job_i,
-                    len([j for j in jobs if j['status'] == statuses[selected_status_i]]) - 1
+                    len(columns[selected_status_i]) - 1
                 ])
 
         win.addnstr(
@@ -221,10 +1047,9 @@ class AWSBW():
             winW,
             curses.A_UNDERLINE
         )
-        for status_i, status in enumerate(statuses):
+        for status_i, status_jobs in enumerate(columns):
             if status_i >= maxCols:
                 break
-            status_jobs = [j for j in jobs if j['status'] == status]
             for job_i, job in enumerate(status_jobs):
                 if job_i > maxJobs:
                     break
@@ -242,8 +1067,15 @@ class AWSBW():
                         job_i + 1,
                         col_width * status_i,
                         job['jobName'].ljust(col_width),
-                        winW
+                        winW,
+                        curses.A_BOLD if job['jobId'] in self.__highlighted__ else curses.A_NORMAL
                     )
+            if status_i == selected_status_i:
+                self.__neighbours__ = [
+                    status_jobs[i]['jobId']
+                    for i in (selected_job_i - 1, selected_job_i + 1)
+                    if 0 <= i < len(status_jobs) and i <= maxJobs
+                ]
             # Clearing out the remainder of the column
             for y in range(job_i + 2, winH):
                 win.addnstr(
@@ -266,34 +1098,24 @@ class AWSBW():
 
         win.refresh()
 
-    def queueJobs(self, queue, status='RUNNING'):
-        session = boto3.session.Session(profile_name=self.__aws_profile__)
-        batch_client = session.client('batch')
+    def awsClient(self, service):
+        # Clients are not safe to share across the fork into the polling
+        # process, so they are cached per pid. Creating them is not thread
+        # safe either, but using them is.
+        pid = os.getpid()
+        with self.__awsClientLock__:
+            if (pid, None) not in self.__awsClients__:
+                self.__awsClients__[(pid, None)] = awsSession(self.__aws_profile__)
+            if (pid, service) not in self.__awsClients__:
+                self.__awsClients__[(pid, service)] = self.__awsClients__[(pid, None)].client(service)
+            return self.__awsClients__[(pid, service)]
 
-        jobs_QS = batch_client.list_jobs(
-            jobQueue=queue,
-            jobStatus=status,
-        )
-        JSL = jobs_QS.get('jobSummaryList', [])
-        nextToken = jobs_QS.get('nextToken', None)
-        while nextToken is not None:
-            jobs_QS = batch_client.list_jobs(
-                jobQueue=queue,
-                jobStatus=status,
-                nextToken=nextToken,
-            )
-            JSL += jobs_QS.get('jobSummaryList', [])
-            nextToken = jobs_QS.get('nextToken', None)
-
-        JSL.sort(key=lambda v: -v['createdAt'])
-        for j in JSL:
-            j.update({'queue': queue})
-        return JSL
+    def queueJobs(self, queue, status='RUNNING'):
+        return listJobs(self.awsClient('batch'), queue, status)
 
     def jobDetails(self, jobId):
-        session = boto3.session.Session(profile_name=self.__aws_profile__)
-        batch_client = session.client('batch')
         try:
+            batch_client = self.awsClient('batch')
             job_info = batch_client.describe_jobs(
                 jobs=[
                     jobId,
@@ -303,17 +1125,113 @@ class AWSBW():
             job_info = None
         return job_info
 
+    def cacheResult(self, cache, jobId, value):
+        with self.__cacheLock__:
+            cache[jobId] = (time.time(), value)
+            cache.move_to_end(jobId)
+            while len(cache) > 256:
+                cache.popitem(last=False)
+
+    def fetchDetails(self, jobId):
+        job = self.__jobStore__.get(jobId)
+        details = self.jobDetails(jobId)
+        # Not if a poll changed the job meanwhile (it may predate the change)
+        if details is not None and self.__jobStore__.get(jobId) is job:
+            self.cacheResult(self.__detailCache__, jobId, details)
+        return details
+
+    def fetchLogHead(self, jobId):
+        job = self.__jobStore__.get(jobId)
+        details = self.cachedJobDetails(jobId)
+        logStream = jobLogStream(details) if details is not None else None
+        if logStream is None:
+            return None
+        try:
+            events = self.fetchLog(logStream[1], True, logStream[0])
+        except Exception:
+            # Not cached, so the next L asks again
+            return None
+        if self.__jobStore__.get(jobId) is job:
+            self.cacheResult(self.__logHeadCache__, jobId, events)
+        return events
+
+    def cached(self, cache, jobId, maxAge=None):
+        # (True, value) for an entry younger than maxAge, else (False, None)
+        with self.__cacheLock__:
+            entry = cache.get(jobId)
+        if entry is None or (maxAge is not None and time.time() - entry[0] > maxAge):
+            return (False, None)
+        return (True, entry[1])
+
+    def logHeadMaxAge(self, jobId):
+        job = self.__jobStore__.get(jobId)
+        if job is not None and job['status'] in ('SUCCEEDED', 'FAILED'):
+            # Finished jobs do not log any more
+            return None
+        return self.__logHeadMaxAge__
+
+    def cachedFetch(self, kind, cache, fetch, jobId, maxAge=None):
+        (hit, value) = self.cached(cache, jobId, maxAge)
+        if hit:
+            return value
+        # Already on its way: wait for it rather than asking twice. A finished
+        # one is either cached above or was dropped because its job changed.
+        future = self.__prefetches__.get((kind, jobId))
+        if future is not None and not future.done():
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return fetch(jobId)
+
+    def cachedJobDetails(self, jobId):
+        return self.cachedFetch('details', self.__detailCache__, self.fetchDetails, jobId)
+
+    def cachedLogHead(self, jobId):
+        return self.cachedFetch('log', self.__logHeadCache__, self.fetchLogHead, jobId, self.logHeadMaxAge(jobId))
+
+    def prefetch(self):
+        # A replay stays offline: only an explicit D or L goes to AWS
+        if self.__replay_path__ is not None:
+            return
+        jobId = self.__curJobId__
+        (restingId, restingSince, scheduled) = self.__cursorRest__
+        if jobId != restingId:
+            # The cursor moved on: drop queued work (what is running finishes into the cache)
+            for (key, future) in list(self.__prefetches__.items()):
+                if future.cancel() or future.done():
+                    del self.__prefetches__[key]
+            self.__cursorRest__ = (jobId, time.time(), False)
+            return
+        # Only once the cursor rests, so arrowing past jobs costs nothing
+        if jobId is None or scheduled or time.time() - restingSince < 0.25:
+            return
+        self.__cursorRest__ = (jobId, restingSince, True)
+        if self.__prefetchPool__ is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.__prefetchPool__ = ThreadPoolExecutor(max_workers=4)
+        # Details first for all, as each log head needs its job's details
+        for (kind, cache, fetch) in [
+                ('details', self.__detailCache__, self.fetchDetails),
+                ('log', self.__logHeadCache__, self.fetchLogHead)]:
+            for jid in [jobId] + self.__neighbours__:
+                maxAge = self.logHeadMaxAge(jid) if kind == 'log' else None
+                future = self.__prefetches__.get((kind, jid))
+                if not self.cached(cache, jid, maxAge)[0] and (future is None or future.done()):
+                    self.__prefetches__[(kind, jid)] = self.__prefetchPool__.submit(fetch, jid)
+
     def terminateJob(self, jobId):
-        batch_client = boto3.client('batch')
+        batch_client = self.awsClient('batch')
         batch_client.terminate_job(
             jobId=jobId,
             reason='Terminated by user'
         )
 
     def terminateJobDialog(self):
-        try:
-            job = [j for j in self.__currentJobs__ if j['jobId'] == self.__curJobId__][0]
-        except:
+        if self.__replay_path__ is not None:
+            return
+        job = self.__jobStore__.get(self.__curJobId__)
+        if job is None:
             return
         p = panel.new_panel(self.__stdscr__)
         p.top()
@@ -351,21 +1269,214 @@ class AWSBW():
             p_win.refresh()
             time.sleep(1)
 
-        p_win.nodelay(True)
+        p_win.timeout(100)
         p.hide()
         self.screenRefresh(forceRedraw=True)
 
+    def drainJobDeltas(self):
+        # The polling process sends only what changed in each poll, so this
+        # is O(changed) however many jobs there are. It draws nothing, so
+        # panels call it too and transitions are noted while they are open.
+        from queue import Empty
+        changed = set()
+        while True:
+            try:
+                (last_check, upserts, removals, transitions, reset) = self.__jobDeltas__.get_nowait()
+            except Empty:
+                break
+            if reset:
+                # A whole snapshot, e.g. after seeking a replay
+                changed |= self.__jobStore__.update(upserts)
+            else:
+                self.__jobStore__.apply(upserts, removals)
+                changed |= {j['jobId'] for j in upserts} | set(removals)
+            self.noteTransitions(transitions)
+            if self.__lastJobCheck__ is None:
+                self.__jobsDirty__ = True
+            self.__lastJobCheck__ = last_check
+        if len(changed) == 0:
+            return
+        self.__jobsDirty__ = True
+        # Prefetched details and logs are stale once their job changes
+        with self.__cacheLock__:
+            for jobId in changed:
+                self.__detailCache__.pop(jobId, None)
+                self.__logHeadCache__.pop(jobId, None)
+        for jobId in changed:
+            for kind in ('details', 'log'):
+                future = self.__prefetches__.pop((kind, jobId), None)
+                if future is not None:
+                    future.cancel()
+
     def refreshJobs(self):
-        if (self.__lastJobCheck__ is not None) and (time.time() - self.__lastJobCheck__ <= self.__job_polling_sec__):
+        self.drainJobDeltas()
+        if not self.__jobsDirty__:
             return False
-        elif {j['jobId'] for j in self.__currentJobs__} != {j['jobId'] for j in self.__jobList__}:
-            self.__currentJobs__ = [j for j in self.__jobList__]
-            if len(self.__jobList__) != 0:
-                self.__lastJobCheck__ = self.__jobProcessStatus__.get('last_check')
-            self.showJobs()
-            return True
+        self.__jobsDirty__ = False
+        if len(self.__filterQuery__) > 0:
+            self.filterJobs()
+        self.showJobs()
+        return True
+
+    def panelKey(self):
+        # Panels cover the grid: keep up with polls without redrawing it
+        self.drainJobDeltas()
+        return self.__stdscr__.getch()
+
+    def noteTransitions(self, transitions):
+        ring = False
+        for transition in transitions:
+            self.__transitions__.appendleft(transition)
+            if transition['status'] in self.__bell_statuses__:
+                ring = True
+                self.__highlighted__.add(transition['jobId'])
+        if ring:
+            curses.beep()
+
+    def notify(self, transition):
+        # Runs in the polling process, so hooks fire whatever the UI is doing
+        commands = self.__status_commands__.get(transition['status'], []) + self.__status_commands__.get('*', [])
+        sockets = self.__status_sockets__.get(transition['status'], []) + self.__status_sockets__.get('*', [])
+        if len(commands) == 0 and len(sockets) == 0:
+            return
+        if self.__hookPool__ is None:
+            # One at a time, in order, and never on the UI thread
+            from concurrent.futures import ThreadPoolExecutor
+            self.__hookPool__ = ThreadPoolExecutor(max_workers=1)
+        self.__hookPool__.submit(self.runHooks, transition, commands, sockets)
+
+    def runHooks(self, transition, commands, sockets):
+        import socket
+        import subprocess
+        env = dict(os.environ)
+        env.update({
+            'AWSBW_JOB_ID': transition['jobId'],
+            'AWSBW_JOB_NAME': transition['jobName'],
+            'AWSBW_QUEUE': transition['queue'],
+            'AWSBW_FROM_STATUS': transition['fromStatus'] or '',
+            'AWSBW_STATUS': transition['status'],
+        })
+        for command in commands:
+            try:
+                subprocess.run(
+                    command,
+                    shell=True,
+                    env=env,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=60,
+                )
+            except Exception:
+                pass
+        # One JSON line per connection to each local socket
+        message = (json.dumps(transition) + '\n').encode('utf-8')
+        for path in sockets:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(5)
+                    sock.connect(path)
+                    sock.sendall(message)
+            except OSError:
+                pass
+
+    def transition_panel(self):
+        tp = panel.new_panel(self.__stdscr__)
+        tp.top()
+        tp.show()
+        tp_win = tp.window()
+        winH, winW = tp_win.getmaxyx()
+        if winH < 5:
+            tp.hide()
+            self.__stdscr__.border()
+            return
+        tp_win.clear()
+        tp_win.border()
+        tp_win.addstr(
+            winH - 1,
+            int(winW / 2) - 3,
+            "ESC to close"
+        )
+        # The feed as of opening; new transitions show after closing
+        transitions = list(self.__transitions__)
+        title = "{:,} status transitions, newest first".format(len(transitions))
+        tp_win.addnstr(1, 1, title, winW - 2)
+        if len(transitions) == 0:
+            transitions = [None]
+
+        line_first = 0
+        drawn = None
+        # Transition window loop!
+        while True:
+            if line_first == drawn:
+                c = self.panelKey()
+                if c == 27:
+                    break
+                elif c == curses.KEY_DOWN:
+                    line_first = min(line_first + 1, len(transitions) - 1)
+                elif c == curses.KEY_UP:
+                    line_first = max(0, line_first - 1)
+                elif c == curses.KEY_NPAGE or c == 32:
+                    line_first = min(line_first + winH - 4, len(transitions) - 1)
+                elif c == curses.KEY_PPAGE:
+                    line_first = max(0, line_first - (winH - 4))
+                continue
+            drawn = line_first
+            lines = [
+                "{} {} {} ({}): {} -> {}".format(
+                    datetime.fromtimestamp(t['time']).strftime('%Y-%m-%d %H:%M:%S'),
+                    t['queue'],
+                    t['jobName'],
+                    t['jobId'],
+                    t['fromStatus'] or "new",
+                    t['status'],
+                ) if t is not None else "No transitions yet"
+                for t in transitions[line_first:line_first + winH]
+            ]
+            self.displayList(
+                lines + [" "] * winH,
+                win=tp_win,
+                Hoffset=3,
+                Hmax=winH - 1,
+                Woffset=1,
+                Wmax=winW - 2,
+            )
+        # Seen now, so stop highlighting (but not what arrived meanwhile)
+        self.__highlighted__ -= {t['jobId'] for t in transitions if t is not None}
+        tp_win.clear()
+        tp.hide()
+        self.screenRefresh(forceRedraw=True)
+
+    def filterJobs(self):
+        try:
+            self.__filterMatch__ = self.__jobStore__.match(
+                self.__filterQuery__,
+                self.__filterMode__
+            )
+            self.__filterError__ = None
+        except re.error:
+            # Keep the last good match while a regex is half typed
+            self.__filterError__ = "bad regex"
+
+    def filterInput(self, c):
+        if c == 27:  # esc
+            self.__filterQuery__ = ""
+            self.__filterTyping__ = False
+        elif c == 10 or c == curses.KEY_ENTER:
+            self.__filterTyping__ = False
+            return
+        elif c == 9:  # tab
+            self.__filterMode__ = JobStore.FILTER_MODES[
+                (JobStore.FILTER_MODES.index(self.__filterMode__) + 1) % len(JobStore.FILTER_MODES)
+            ]
+        elif c == curses.KEY_BACKSPACE or c == 127 or c == 8:
+            self.__filterQuery__ = self.__filterQuery__[:-1]
+        elif 32 <= c <= 126:
+            self.__filterQuery__ += chr(c)
         else:
-            return False
+            return
+        self.filterJobs()
+        self.showJobs()
 
     def queueRight(self):
         prior_queue = self.__curJobQueue__
@@ -387,6 +1498,435 @@ class AWSBW():
         if prior_queue != self.__curJobQueue__:
             self.showJobs()
 
+    def setQueues(self, jobQueues):
+        if len(jobQueues) == 0 or jobQueues == self.__jobQueues__:
+            return
+        self.__jobQueues__ = jobQueues
+        if self.__curJobQueue__ not in jobQueues:
+            self.__curJobQueue__ = jobQueues[0]
+        # Let the polling process pick up the new queues right away
+        self.__jobProcessStatus__['queues'] = list(jobQueues)
+        self.__jobProcessStatus__['refresh'] = True
+
+    def queue_panel(self):
+        qp = panel.new_panel(self.__stdscr__)
+        qp.top()
+        qp.show()
+        qp_win = qp.window()
+        winH, winW = qp_win.getmaxyx()
+        if winH < 5:
+            qp.hide()
+            self.__stdscr__.border()
+            return
+        qp_win.clear()
+        qp_win.border()
+        qp_win.addstr(
+            winH - 1,
+            max(1, int(winW / 2) - 27),
+            " SPACE toggle. ENTER watch selected. ESC to close "
+        )
+        qp_win.addnstr(
+            1,
+            1,
+            "Batch queues",
+            winW - 2,
+        )
+
+        selected = list(self.__jobQueues__)
+        queue_i = 0
+        queue_first = 0
+        queueInfo = {}
+        c = None
+        # Queue picker loop!
+        while True:
+            if len(queueInfo) == 0:
+                # Filled in by the polling process on its capacity schedule
+                queueInfo = self.__jobProcessStatus__.get('queue_info') or {}
+                if len(queueInfo) == 0:
+                    qp_win.addnstr(
+                        3,
+                        1,
+                        "Loading queues......".ljust(winW - 2),
+                        winW - 2,
+                    )
+                    qp_win.refresh()
+                queues = sorted(set(queueInfo) | set(selected))
+
+            if c == 27:
+                break
+            elif c == 10 or c == curses.KEY_ENTER:
+                self.setQueues([q for q in selected if q in queues])
+                break
+            elif c == 32 and len(queues) > 0:
+                if queues[queue_i] in selected:
+                    selected.remove(queues[queue_i])
+                else:
+                    selected.append(queues[queue_i])
+            elif c == curses.KEY_DOWN:
+                queue_i = max(0, min(queue_i + 1, len(queues) - 1))
+            elif c == curses.KEY_UP:
+                queue_i = max(queue_i - 1, 0)
+
+            if len(queueInfo) > 0:
+                maxRows = winH - 4
+                if queue_i < queue_first:
+                    queue_first = queue_i
+                elif queue_i >= queue_first + maxRows:
+                    queue_first = queue_i - maxRows + 1
+                for row_i in range(maxRows):
+                    q_i = queue_first + row_i
+                    if q_i >= len(queues):
+                        qp_win.addnstr(row_i + 3, 1, "".ljust(winW - 2), winW - 2)
+                        continue
+                    q = queues[q_i]
+                    info = queueInfo.get(q, {})
+                    line = "[{}] {}  {} {}  priority {}".format(
+                        'x' if q in selected else ' ',
+                        q,
+                        info.get('state', ''),
+                        info.get('status', ''),
+                        info.get('priority', ''),
+                    )
+                    qp_win.addnstr(
+                        row_i + 3,
+                        1,
+                        line.ljust(winW - 2),
+                        winW - 2,
+                        curses.A_REVERSE if q_i == queue_i else 0
+                    )
+                qp_win.refresh()
+            c = self.panelKey()
+
+        qp_win.clear()
+        qp.hide()
+        self.screenRefresh(forceRedraw=True)
+
+    def capacity_panel(self):
+        cp = panel.new_panel(self.__stdscr__)
+        cp.top()
+        cp.show()
+        cp_win = cp.window()
+        winH, winW = cp_win.getmaxyx()
+        if winH < 5:
+            cp.hide()
+            self.__stdscr__.border()
+            return
+        cp_win.clear()
+        cp_win.border()
+        cp_win.addstr(
+            winH - 1,
+            int(winW / 2) - 3,
+            "ESC to close"
+        )
+
+        last_capacity_check = False
+        # Capacity window loop!
+        while True:
+            # Only redraw when the polling process has new capacity data
+            capacity_check = self.__jobProcessStatus__.get('capacity_check')
+            if capacity_check != last_capacity_check:
+                last_capacity_check = capacity_check
+                self.displayList(
+                    self.capacityLines(),
+                    win=cp_win,
+                    Hoffset=1,
+                    Hmax=winH - 1,
+                    Woffset=1,
+                    Wmax=winW - 2,
+                )
+            c = self.panelKey()
+            if c == 27:
+                cp_win.clear()
+                cp.hide()
+                self.screenRefresh(forceRedraw=True)
+                break
+
+    def capacityLines(self):
+        if self.__jobProcessStatus__.get('capacity_check') is None:
+            return ["Loading compute environments......"]
+        lines = [
+            "Capacity as of {}".format(
+                datetime.fromtimestamp(
+                    self.__jobProcessStatus__['capacity_check']).strftime('%Y-%m-%d %H:%M:%S')
+            )
+        ]
+        if self.__jobProcessStatus__.get('capacity_error') is not None:
+            lines.append("Error: {}".format(self.__jobProcessStatus__['capacity_error']))
+        queueInfo = self.__jobProcessStatus__.get('queue_info') or {}
+        capacity = self.__jobProcessStatus__.get('capacity') or {}
+        statusCounts = Counter(
+            (j['queue'], j['status']) for j in self.__jobStore__.jobs()
+        )
+        for q in self.__jobQueues__:
+            info = queueInfo.get(q, {})
+            runnable = statusCounts[(q, 'RUNNABLE')]
+            lines.append("")
+            lines.append("{}  {} {}  RUNNABLE: {}  STARTING: {}  RUNNING: {}".format(
+                q,
+                info.get('state', ''),
+                info.get('status', ''),
+                runnable,
+                statusCounts[(q, 'STARTING')],
+                statusCounts[(q, 'RUNNING')],
+            ))
+            for ce in info.get('computeEnvironments', []):
+                env = capacity.get(ce, {})
+                desired = env.get('desiredvCpus', 0)
+                maxvCpus = env.get('maxvCpus', 0)
+                warning = ""
+                if runnable > 0 and env.get('state') != 'ENABLED':
+                    warning = "  << DISABLED with RUNNABLE jobs"
+                elif runnable > 0 and maxvCpus > 0 and desired >= maxvCpus:
+                    warning = "  << at max vCPUs with RUNNABLE jobs"
+                lines.append("    {}  {} {}  vCPUs desired {} (min {}, max {}){}".format(
+                    ce,
+                    env.get('state', ''),
+                    env.get('status', ''),
+                    desired,
+                    env.get('minvCpus', 0),
+                    maxvCpus,
+                    warning,
+                ))
+        return lines
+
+    def columnJobs(self, jobId):
+        # Every job in the grid column holding jobId, not only those on screen
+        job = self.__jobStore__.get(jobId)
+        if job is None:
+            return (None, [])
+        group = self.__jobStore__.groupKey(job, self.__grouping__)
+        cutoff_ts = self.cutoffTs()
+        jobs = []
+        for (key, jobId) in self.__jobStore__.view(
+                self.__curJobQueue__,
+                self.__grouping__,
+                self.__ordering__).get(group, []):
+            if self.__filterMatch__ is not None and jobId not in self.__filterMatch__:
+                continue
+            j = self.__jobStore__.get(jobId)
+            if j['createdAt'] >= cutoff_ts:
+                jobs.append(j)
+        return (group, jobs)
+
+    def export_panel(self):
+        (group, jobs) = self.columnJobs(self.__curJobId__)
+        if len(jobs) == 0:
+            return
+        ep = panel.new_panel(self.__stdscr__)
+        ep.top()
+        ep.show()
+        ep_win = ep.window()
+        winH, winW = ep_win.getmaxyx()
+        if winH < 5:
+            ep.hide()
+            self.__stdscr__.border()
+            return
+        ep_win.clear()
+        ep_win.border()
+        ep_win.addstr(
+            winH - 1,
+            int(winW / 2) - 3,
+            "ESC to close"
+        )
+        ep_win.addnstr(
+            1,
+            1,
+            "Exporting logs for {:,} {} jobs on {} to {}".format(
+                len(jobs),
+                group,
+                self.__curJobQueue__,
+                os.path.abspath(self.__export_dir__)
+            ),
+            winW - 2,
+        )
+        ep_win.refresh()
+
+        exporter = LogExporter(
+            self.awsClient('batch'),
+            self.awsClient('logs'),
+            self.__export_dir__,
+            self.__export_workers__,
+            self.__export_rate__,
+        )
+        cancel = threading.Event()
+        results = []
+        exportThread = threading.Thread(
+            target=exporter.exportJobs,
+            args=(jobs, cancel, lambda job, path, error: results.append((job, path, error))),
+            daemon=True,
+        )
+        exportThread.start()
+
+        # Export window loop!
+        while True:
+            done = len(results)
+            failed = [r for r in results[:done] if r[2] is not None]
+            if not exportThread.is_alive():
+                state = "Cancelled." if cancel.is_set() else "Done."
+            elif cancel.is_set():
+                state = "Cancelling......"
+            else:
+                state = "Exporting......"
+            self.displayList(
+                [
+                    "{} {:,} of {:,} jobs. {:,} failed.".format(state, done, len(jobs), len(failed)),
+                    "",
+                ] + [
+                    "{}: {}".format(job['jobName'], error)
+                    for (job, path, error) in failed
+                ],
+                win=ep_win,
+                Hoffset=3,
+                Hmax=winH - 1,
+                Woffset=1,
+                Wmax=winW - 2,
+            )
+            c = self.panelKey()
+            if c == 27:
+                if exportThread.is_alive():
+                    # Streams in flight stop at their next page
+                    cancel.set()
+                else:
+                    break
+        ep_win.clear()
+        ep.hide()
+        self.screenRefresh(forceRedraw=True)
+
+    def grep_panel(self):
+        (group, jobs) = self.columnJobs(self.__curJobId__)
+        if len(jobs) == 0:
+            return
+        gp = panel.new_panel(self.__stdscr__)
+        gp.top()
+        gp.show()
+        gp_win = gp.window()
+        winH, winW = gp_win.getmaxyx()
+        if winH < 6:
+            gp.hide()
+            self.__stdscr__.border()
+            return
+        gp_win.clear()
+        gp_win.border()
+        gp_win.addstr(
+            winH - 1,
+            int(winW / 2) - 3,
+            "ESC to close"
+        )
+        title = "Search logs of {:,} {} jobs on {}".format(len(jobs), group, self.__curJobQueue__)
+        gp_win.addnstr(1, 1, title, winW - 2)
+
+        # Pattern prompt
+        pattern = ""
+        while True:
+            gp_win.addnstr(
+                3,
+                1,
+                "Filter pattern (CloudWatch Logs syntax): {}_".format(pattern).ljust(winW - 2),
+                winW - 2,
+            )
+            gp_win.refresh()
+            c = self.panelKey()
+            if c == 27:
+                gp_win.clear()
+                gp.hide()
+                self.screenRefresh(forceRedraw=True)
+                return
+            elif (c == 10 or c == curses.KEY_ENTER) and len(pattern) > 0:
+                break
+            elif c == curses.KEY_BACKSPACE or c == 127 or c == 8:
+                pattern = pattern[:-1]
+            elif 32 <= c <= 126:
+                pattern += chr(c)
+
+        # Hits by job, in the order jobs first matched
+        hits = {}
+        hitCounts = Counter()
+        progress = {'done': 0, 'total': None, 'errors': []}
+
+        def onHit(job, event):
+            if job['jobId'] not in hits:
+                hits[job['jobId']] = (job, [])
+            hitCounts[job['jobId']] += 1
+            # Enough to see the cause; the count still covers every hit
+            if len(hits[job['jobId']][1]) < 100:
+                hits[job['jobId']][1].append(event['message'].rstrip())
+
+        def onProgress(done, total, error):
+            progress['done'] = done
+            progress['total'] = total
+            if error is not None:
+                progress['errors'].append(error)
+
+        cancel = threading.Event()
+        grepThread = threading.Thread(
+            target=LogGrep(
+                self.awsClient('batch'),
+                self.awsClient('logs'),
+                self.__export_workers__,
+                self.__export_rate__,
+            ).grep,
+            args=(jobs, pattern, cancel, onHit, onProgress),
+            daemon=True,
+        )
+        grepThread.start()
+
+        line_first = 0
+        lastDrawn = None
+        # Results window loop!
+        while True:
+            if not grepThread.is_alive():
+                state = "Cancelled." if cancel.is_set() else "Done."
+            elif cancel.is_set():
+                state = "Cancelling......"
+            else:
+                state = "Searching......"
+            status = "{} {} of {} batches. {:,} hits in {:,} jobs. {}".format(
+                state,
+                progress['done'],
+                progress['total'] if progress['total'] is not None else "?",
+                sum(hitCounts.values()),
+                len(hits),
+                progress['errors'][-1] if len(progress['errors']) > 0 else "",
+            )
+            if (status, line_first) != lastDrawn:
+                lastDrawn = (status, line_first)
+                lines = []
+                for (job, messages) in list(hits.values()):
+                    lines.append("== {} ({}): {:,} hits".format(
+                        job['jobName'],
+                        job['jobId'],
+                        hitCounts[job['jobId']],
+                    ))
+                    lines += ["  " + m for m in messages]
+                gp_win.addnstr(3, 1, "Pattern: {}".format(pattern).ljust(winW - 2), winW - 2)
+                gp_win.addnstr(4, 1, status.ljust(winW - 2), winW - 2)
+                # Blank lines clear what scrolled off
+                self.displayList(
+                    lines[line_first:] + [" "] * winH,
+                    win=gp_win,
+                    Hoffset=6,
+                    Hmax=winH - 1,
+                    Woffset=1,
+                    Wmax=winW - 2,
+                )
+            c = self.panelKey()
+            if c == 27:
+                if grepThread.is_alive():
+                    cancel.set()
+                else:
+                    break
+            elif c == curses.KEY_DOWN:
+                line_first = min(line_first + 1, max(0, len(lines) - 1))
+            elif c == curses.KEY_UP:
+                line_first = max(0, line_first - 1)
+            elif c == curses.KEY_NPAGE or c == 32:
+                line_first = min(line_first + winH - 7, max(0, len(lines) - 1))
+            elif c == curses.KEY_PPAGE:
+                line_first = max(0, line_first - (winH - 7))
+        gp_win.clear()
+        gp.hide()
+        self.screenRefresh(forceRedraw=True)
+
     def displayList(self, L, win, Hoffset, Hmax, Woffset, Wmax):
         L_i = 0
         for line in L:
@@ -412,9 +1952,8 @@ class AWSBW():
         win.refresh()
 
     def detail_panel(self):
-        try:
-            job = [j for j in self.__currentJobs__ if j['jobId'] == self.__curJobId__][0]
-        except:
+        job = self.__jobStore__.get(self.__curJobId__)
+        if job is None:
             return
 
         dp = panel.new_panel(self.__stdscr__)
@@ -468,7 +2007,7 @@ class AWSBW():
             timingStr,
             winW - 2,
         )
-        jobDetails = self.jobDetails(job['jobId'])
+        jobDetails = self.cachedJobDetails(job['jobId'])
         if jobDetails is not None:
             dp_win.addnstr(
                 3,
@@ -511,7 +2050,7 @@ class AWSBW():
 
         # Detail window loop!
         while True:
-            c = self.__stdscr__.getch()
+            c = self.panelKey()
             if c == 27:
                 dp_win.clear()
                 dp.hide()
@@ -540,33 +2079,34 @@ class AWSBW():
                         Wmax=winW - 2
                     )
 
-    def getLog(self, jobStreamName, startFromHead=False):
-        session = boto3.session.Session(profile_name=self.__aws_profile__)
-        logs_client = session.client('logs')
-        try:
-            jobLog = logs_client.get_log_events(
-                logGroupName='/aws/batch/job',
-                logStreamName=jobStreamName,
-                startFromHead=startFromHead,
+    def fetchLog(self, jobStreamName, startFromHead=False, logGroupName=LOG_GROUP):
+        # Raises on failure, so callers can tell an error from an empty log
+        logs_client = self.awsClient('logs')
+        jobLog = logs_client.get_log_events(
+            logGroupName=logGroupName,
+            logStreamName=jobStreamName,
+            startFromHead=startFromHead,
+        )
+        if startFromHead:
+            return sorted(
+                jobLog['events'],
+                key=lambda e: e['timestamp']
             )
-            if startFromHead:
-                events = sorted(
-                    jobLog['events'],
-                    key=lambda e: e['timestamp']
-                )
-            else:
-                events = sorted(
-                    jobLog['events'],
-                    key=lambda e: -e['timestamp']
-                )
+        return sorted(
+            jobLog['events'],
+            key=lambda e: -e['timestamp']
+        )
+
+    def getLog(self, jobStreamName, startFromHead=False, logGroupName=LOG_GROUP):
+        try:
+            events = self.fetchLog(jobStreamName, startFromHead, logGroupName)
         except:
             events = []
         return events
 
     def log_panel(self):
-        try:
-            job = [j for j in self.__currentJobs__ if j['jobId'] == self.__curJobId__][0]
-        except:
+        job = self.__jobStore__.get(self.__curJobId__)
+        if job is None:
             return
         lp = panel.new_panel(self.__stdscr__)
         lp.top()
@@ -603,18 +2143,18 @@ class AWSBW():
         )
         lp_win.refresh()
 
-        jobDetails = self.jobDetails(job['jobId'])
+        jobDetails = self.cachedJobDetails(job['jobId'])
         if jobDetails is None:
             return
 
-        try:
-            jobStreamName = jobDetails['container']['logStreamName']
-        except:
+        logStream = jobLogStream(jobDetails)
+        if logStream is None:
             return
+        (logGroupName, jobStreamName) = logStream
 
         # Get the log
         startFromHead = True
-        events = self.getLog(jobStreamName, startFromHead)
+        events = self.cachedLogHead(job['jobId']) or []
         event_first = 0
 
         self.displayList(
@@ -631,7 +2171,7 @@ class AWSBW():
 
         # Log window loop!
         while True:
-            c = self.__stdscr__.getch()
+            c = self.panelKey()
             if c == 27:  # esc
                 lp_win.clear()
                 lp.hide()
@@ -646,7 +2186,7 @@ class AWSBW():
                 )
                 lp_win.refresh()
                 startFromHead = not startFromHead
-                events = self.getLog(jobStreamName, startFromHead)
+                events = self.getLog(jobStreamName, startFromHead, logGroupName)
                 event_first = 0
                 self.displayList(
                     [
@@ -702,30 +2242,179 @@ class AWSBW():
                         Wmax=winW - 2,
                     )
 
+    def updateCapacity(self):
+        batch_client = self.awsClient('batch')
+        try:
+            queueInfo = {
+                q['jobQueueName']: {
+                    'state': q.get('state'),
+                    'status': q.get('status'),
+                    'priority': q.get('priority'),
+                    'computeEnvironments': [
+                        ce['computeEnvironment'].split('/')[-1]
+                        for ce in sorted(
+                            q.get('computeEnvironmentOrder', []),
+                            key=lambda ce: ce['order']
+                        )
+                    ],
+                }
+                for q in describeJobQueues(batch_client)
+            }
+            watched = self.__jobProcessStatus__.get('queues', self.__jobQueues__)
+            capacity = {
+                env['computeEnvironmentName']: {
+                    'state': env.get('state'),
+                    'status': env.get('status'),
+                    'minvCpus': env.get('computeResources', {}).get('minvCpus', 0),
+                    'desiredvCpus': env.get('computeResources', {}).get('desiredvCpus', 0),
+                    'maxvCpus': env.get('computeResources', {}).get('maxvCpus', 0),
+                }
+                for env in describeComputeEnvironments(
+                    batch_client,
+                    [
+                        ce
+                        for q in watched
+                        for ce in queueInfo.get(q, {}).get('computeEnvironments', [])
+                    ]
+                )
+            }
+            self.__jobProcessStatus__['queue_info'] = queueInfo
+            self.__jobProcessStatus__['capacity'] = capacity
+            self.__jobProcessStatus__['capacity_error'] = None
+        except Exception as e:
+            self.__jobProcessStatus__['capacity_error'] = str(e)
+        self.__jobProcessStatus__['capacity_check'] = time.time()
+
     def updateJobsLoop(self):
+        # First AWS contact happens here, after the UI has drawn its frame.
+        try:
+            self.awsClient('batch')
+        except Exception as e:
+            self.__jobProcessStatus__['error'] = str(e)
+            return
+        recorder = None
+        if self.__record_path__ is not None:
+            try:
+                recorder = SnapshotRecorder(self.__record_path__)
+            except OSError as e:
+                self.__jobProcessStatus__['error'] = "Cannot record to {}: {}".format(self.__record_path__, e)
+                return
         last_check = None
+        last_capacity_check = None
+        prior = {}
+        # Queues polled last time; new jobs elsewhere are not transitions
+        polledQueues = set()
         while True:
+            if self.__jobProcessStatus__.get('refresh'):
+                # The watched queues changed: fetch their jobs and capacity now
+                self.__jobProcessStatus__['refresh'] = False
+                last_check = None
+                last_capacity_check = None
             if (last_check is None) or (time.time() - last_check >= self.__job_polling_sec__):
                 # Update our time
                 last_check = time.time()
-                self.__jobProcessStatus__['last_check'] = last_check
                 updatedJobs = []
-                for queue in self.__jobQueues__:
+                queues = self.__jobProcessStatus__.get('queues', self.__jobQueues__)
+                for queue in queues:
                     queue_jobs = []
                     for status in self.__jobStatuses__:
                         queue_jobs += self.queueJobs(queue, status)
-                    updatedJobs += sorted(queue_jobs, key=lambda j: -j['createdAt'])
+                    updatedJobs += queue_jobs
                 # All done updating all queues
-                # Clear out the existing jobs
-                del self.__jobList__[:]
-                # Put in our updated job list
-                self.__jobList__.extend(updatedJobs)
-                # Sleep the thread until the next check is due
-                sleep_time = self.__job_polling_sec__ - (time.time() - last_check)
-                if sleep_time > 0:
-                    time.sleep(sleep_time-1)
+                # Send the UI only what changed (every poll, so it knows when we last checked)
+                current = {j['jobId']: j for j in updatedJobs}
+                (upserts, removals) = snapshotDelta(prior, current)
+                transitions = statusTransitions(prior, upserts, last_check, polledQueues)
+                prior = current
+                polledQueues = set(queues)
+                self.__jobDeltas__.put((last_check, upserts, removals, transitions, False))
+                for transition in transitions:
+                    self.notify(transition)
+                if recorder is not None:
+                    recorder.record(last_check, updatedJobs, queues)
+            # Queues and compute environments change slowly; poll them on their own schedule
+            if (last_capacity_check is None) or (time.time() - last_capacity_check >= self.__capacity_polling_sec__):
+                last_capacity_check = time.time()
+                self.updateCapacity()
+            # Short naps so a queue change from the UI is picked up promptly
+            time.sleep(1)
+
+    def replayInput(self, c):
+        status = self.__jobProcessStatus__
+        if status['replay_time'] is None and c in (91, 93, 123, 125):
+            # Still indexing the recording: nowhere to seek from yet
+            return
+        if c == 91 or c == 93:  # [ or ]
+            status['replay_seek'] = status['replay_time'] + (3600 if c == 93 else -3600)
+        elif c == 123 or c == 125:  # { or }
+            status['replay_seek'] = status['replay_time'] + (86400 if c == 125 else -86400)
+        elif c == 45:  # -
+            status['replay_speed'] = max(status['replay_speed'] / 2, 1 / 64)
+        elif c == 43 or c == 61:  # + or =
+            status['replay_speed'] = min(status['replay_speed'] * 2, 65536)
+        elif c == 80 or c == 112:  # P or p
+            status['replay_paused'] = not status['replay_paused']
+
+    def replayJobsLoop(self):
+        # Stands in for updateJobsLoop, reading snapshots from a recording
+        # against a clock the UI can speed up, pause and move.
+        status = self.__jobProcessStatus__
+        try:
+            replay = SnapshotReplay(self.__replay_path__)
+        except (OSError, ValueError) as e:
+            status['error'] = str(e)
+            return
+        status['queue_info'] = {q: {} for q in replay.queues()}
+        status['capacity_error'] = "Capacity is not recorded"
+        status['capacity_check'] = replay.start()
+        clock = replay.start()
+        last_wall = time.time()
+        published = None
+        prior = {}
+        reset = True
+        while True:
+            now = time.time()
+            seek = status.get('replay_seek')
+            if seek is not None:
+                status['replay_seek'] = None
+                clock = min(max(seek, replay.start()), replay.end())
+                replay.seek(clock)
+                reset = True
+            elif not status.get('replay_paused'):
+                clock = min(clock + (now - last_wall) * status.get('replay_speed'), replay.end())
+                replay.advance(clock)
+            last_wall = now
+            status['replay_time'] = clock
+            if replay.time() != published:
+                published = replay.time()
+                current = {j['jobId']: j for j in replay.jobs()}
+                if reset:
+                    self.__jobDeltas__.put((published, list(current.values()), [], [], True))
+                    reset = False
+                else:
+                    # Replayed transitions go in the feed but run no hooks
+                    (upserts, removals) = snapshotDelta(prior, current)
+                    transitions = statusTransitions(prior, upserts, published)
+                    self.__jobDeltas__.put((published, upserts, removals, transitions, False))
+                prior = current
+            time.sleep(0.2)
 
     def handleInput(self, c):
+        if self.__filterTyping__:
+            if c in (curses.KEY_UP, curses.KEY_DOWN, curses.KEY_LEFT, curses.KEY_RIGHT):
+                self.showJobs(c)
+            else:
+                self.filterInput(c)
+            return
+
+        if self.__replay_path__ is not None:
+            self.replayInput(c)
+
+        if c == 47:  # /
+            self.__filterTyping__ = True
+        if c == 27 and len(self.__filterQuery__) > 0:
+            self.filterInput(c)
+
         if c == curses.KEY_UP or c == curses.KEY_DOWN:
             self.showJobs(c)
         if c == curses.KEY_LEFT or c == curses.KEY_RIGHT:
@@ -745,27 +2434,71 @@ class AWSBW():
         if c == 84 or c == 116:
             self.terminateJobDialog()
 
+        if c == 83 or c == 115:
+            self.queue_panel()
+
+        if c == 79 or c == 111:  # O or o
+            self.__ordering__ = JobStore.ORDERINGS[
+                (JobStore.ORDERINGS.index(self.__ordering__) + 1) % len(JobStore.ORDERINGS)
+            ]
+            self.showJobs()
+
+        if c == 71 or c == 103:  # G or g
+            self.__grouping__ = JobStore.GROUPINGS[
+                (JobStore.GROUPINGS.index(self.__grouping__) + 1) % len(JobStore.GROUPINGS)
+            ]
+            self.showJobs()
+
+        if c == 67 or c == 99:
+            self.capacity_panel()
+
+        if c == 69 or c == 101:
+            self.export_panel()
+
+        if c == 70 or c == 102:
+            self.grep_panel()
+
+        if c == 72 or c == 104:
+            self.transition_panel()
+
     def actionLoop(self):
         # Start job update thread
 
         with Manager() as self.__jobManager__:
-            self.__jobList__ = self.__jobManager__.list()
+            self.__jobDeltas__ = self.__jobManager__.Queue()
             self.__jobProcessStatus__ = self.__jobManager__.dict()
-            self.__jobProcessStatus__['last_check'] = None
+            self.__jobProcessStatus__['error'] = None
+            self.__jobProcessStatus__['queues'] = list(self.__jobQueues__)
+            self.__jobProcessStatus__['refresh'] = False
+            self.__jobProcessStatus__['capacity_check'] = None
+            self.__jobProcessStatus__['replay_time'] = None
+            self.__jobProcessStatus__['replay_seek'] = None
+            self.__jobProcessStatus__['replay_speed'] = self.__replay_speed__
+            self.__jobProcessStatus__['replay_paused'] = False
             self.__jobProcess__ = Process(
-                target=self.updateJobsLoop,
+                target=self.updateJobsLoop if self.__replay_path__ is None else self.replayJobsLoop,
             )
             self.__jobProcess__.start()
+            error = None
             while True:
                 c = self.__stdscr__.getch()
-                if c == 113 or c == 81:
+                if (c == 113 or c == 81) and not self.__filterTyping__:
                     break
                 self.handleInput(c)
                 self.refreshJobs()
                 self.screenRefresh()
+                self.prefetch()
                 if not self.__jobProcess__.is_alive():
-                    raise Exception("Job Thread Died")
+                    error = self.__jobProcessStatus__.get('error')
+                    if error is None:
+                        raise Exception("Job Thread Died")
+                    break
             self.__jobProcess__.terminate()
+        if self.__prefetchPool__ is not None:
+            for future in self.__prefetches__.values():
+                future.cancel()
+            self.__prefetchPool__.shutdown(wait=False)
+        return error
 
 
 def start(stdscr, args):
@@ -774,10 +2507,66 @@ def start(stdscr, args):
         args.queue,
         args.max_age_days,
         args.profile,
-        args.job_polling_sec
+        args.job_polling_sec,
+        args.capacity_polling_sec,
+        args.export_dir,
+        args.export_workers,
+        args.export_rate,
+        args.record,
+        args.replay,
+        args.replay_speed,
+        args.bell,
+        statusHooks(args.on_status),
+        statusHooks(args.notify_socket)
     )
     # UI action loop
-    awsbw.actionLoop()
+    return awsbw.actionLoop()
+
+
+def statusHooks(specs):
+    # ['FAILED=cmd', ...] -> {'FAILED': ['cmd', ...]}
+    hooks = {}
+    for spec in specs or []:
+        (status, hook) = spec.split('=', 1)
+        hooks.setdefault(status.strip().upper(), []).append(hook)
+    return hooks
+
+
+def exportLogs(args):
+    session = awsSession(args.profile)
+    cutoff_ts = (time.time() - args.max_age_days * 24 * 3600) * 1000
+    try:
+        batch_client = session.client('batch')
+        jobs = [
+            j
+            for queue in args.queue
+            for status in args.export_status
+            for j in listJobs(batch_client, queue, status)
+            if j['createdAt'] >= cutoff_ts
+        ]
+    except Exception as e:
+        # A mistyped queue, missing credentials or throttling
+        print("Error listing jobs from batch: {}".format(e))
+        return False
+    print("Exporting logs for {:,} jobs to {}".format(len(jobs), os.path.abspath(args.export_dir)))
+    exporter = LogExporter(
+        batch_client,
+        session.client('logs'),
+        args.export_dir,
+        args.export_workers,
+        args.export_rate,
+    )
+
+    def report(job, path, error):
+        if error is None:
+            print("\t{}".format(path))
+        else:
+            print("\t{} ({}): {}".format(job['jobName'], job['jobId'], error))
+
+    results = exporter.exportJobs(jobs, onDone=report)
+    failed = len([r for r in results if r[2] is not None])
+    print("Exported {:,} logs. {:,} failed.".format(len(results) - failed, failed))
+    return failed == 0
 
 
 def main():
@@ -814,27 +2603,119 @@ def main():
         default='60',
         help="Seconds between polling for jobs (default 60 sec). Int only"
     )
+    parser.add_argument(
+        '--capacity-polling-sec',
+        type=int,
+        default='300',
+        help="Seconds between polling queues and compute environments (default 300 sec). Int only"
+    )
+    parser.add_argument(
+        '-E', '--export-logs',
+        action='store_true',
+        help="Export logs for jobs on the queue(s) with --export-status and exit"
+    )
+    parser.add_argument(
+        '--export-status',
+        nargs='+',
+        default=['FAILED'],
+        help="Job status(es) to export logs for with --export-logs (default FAILED)"
+    )
+    parser.add_argument(
+        '--export-dir',
+        default='awsbw-logs',
+        help="Directory for exported logs, as <jobName>_<jobId>.log.gz (default awsbw-logs)"
+    )
+    parser.add_argument(
+        '--export-workers',
+        type=int,
+        default='8',
+        help="Log streams to download at once (default 8). Int only"
+    )
+    parser.add_argument(
+        '--export-rate',
+        type=float,
+        default='10',
+        help="Maximum log requests per second while exporting (default 10)"
+    )
+    parser.add_argument(
+        '--record',
+        help="Append each polled snapshot to this file for later --replay"
+    )
+    parser.add_argument(
+        '--replay',
+        help="Show snapshots from a --record file instead of polling AWS"
+    )
+    parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default='60',
+        help="Recorded seconds per second of replay (default 60)"
+    )
+    parser.add_argument(
+        '--bell',
+        nargs='*',
+        default=['FAILED'],
+        help="Ring the bell and highlight jobs entering these statuses (default FAILED)"
+    )
+    parser.add_argument(
+        '--on-status',
+        action='append',
+        metavar='STATUS=COMMAND',
+        help="Run a shell command when a job enters STATUS (* for any). "
+        "AWSBW_JOB_ID, AWSBW_JOB_NAME, AWSBW_QUEUE, AWSBW_FROM_STATUS and AWSBW_STATUS are set. Repeatable"
+    )
+    parser.add_argument(
+        '--notify-socket',
+        action='append',
+        metavar='STATUS=PATH',
+        help="Send a JSON line to the unix socket at PATH when a job enters STATUS (* for any). Repeatable"
+    )
     args = parser.parse_args()
-    # Verify the profile exists
 
-    if args.profile not in boto3.session.Session().available_profiles:
-        print("AWS profile {} does not exist.".format(
-            args.profile)
-        )
-        print("Available profiles: {}".format(
-            ", ".join(boto3.session.Session().available_profiles)
-        ))
-        print("Exiting.")
-        sys.exit(1)
+    for spec in (args.on_status or []) + (args.notify_socket or []):
+        if '=' not in spec:
+            parser.error("expected STATUS=..., got {}".format(spec))
+
+    if args.replay is not None and args.record is not None:
+        parser.error("--record and --replay cannot be used together")
 
-    if args.list_queues:
+    if args.replay is not None:
+        try:
+            keyframe = firstKeyframe(args.replay)
+        except (OSError, ValueError) as e:
+            print("Cannot replay {}: {}".format(args.replay, e))
+            print("Exiting.")
+            sys.exit(1)
+        if args.queue is None:
+            args.queue = list(keyframe['queues'])
+        error = wrapper(start, args)
+        if error is not None:
+            print(error)
+            print("Exiting.")
+            sys.exit(1)
+    elif args.export_logs:
+        if args.queue is None:
+            parser.error("--export-logs needs queue(s) from -Q")
+        try:
+            ok = exportLogs(args)
+        except ValueError as e:
+            print(e)
+            print("Exiting.")
+            sys.exit(1)
+        sys.exit(0 if ok else 1)
+    elif args.list_queues:
+        try:
+            session = awsSession(args.profile)
+        except ValueError as e:
+            print(e)
+            print("Exiting.")
+            sys.exit(1)
         print("Available batch queues:")
         try:
-            session = boto3.session.Session(profile_name=args.profile)
             batch_client = session.client('batch')
             queues = [
                 q['jobQueueName'] for q in
-                batch_client.describe_job_queues().get('jobQueues', [])
+                describeJobQueues(batch_client)
             ]
             for q in queues:
                 print("\t{}".format(q))
@@ -842,7 +2723,12 @@ def main():
             print("Error loading queues from batch: {}".format(e))
         sys.exit(0)
     elif args.queue is not None:
-        wrapper(start, args)
+        # The profile is verified by the polling process once the UI is up.
+        error = wrapper(start, args)
+        if error is not None:
+            print(error)
+            print("Exiting.")
+            sys.exit(1)
     else:
         parser.print_help()
 